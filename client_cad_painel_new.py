@@ -1,29 +1,84 @@
 import asyncio
 import logging
 import os
+import time
+import orjson
 import requests
-import pandas as pd
-from playwright.async_api import async_playwright
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
 from tqdm import tqdm
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 from dotenv import load_dotenv
 
 # Carrega as variáveis de ambiente do arquivo .env (para uso local)
 load_dotenv()
 
-# Configuração do logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s: %(message)s",
-    datefmt='%d/%m/%Y %H:%M:%S',
-    filename='painel_novo.log',
-    filemode='w',
+# Quantidade de status acumulados antes de enviar um PATCH em lote ao Supabase
+STATUS_BATCH_SIZE = 25
+# Fila de status consumida em segundo plano enquanto o Playwright segue para a próxima faixa
+STATUS_QUEUE_SIZE = 32
+# Quantidade de páginas do navegador cadastrando faixas em paralelo
+CONCURRENCY = 4
+# Registros pedidos por página na leitura do Supabase (o max-rows do projeto pode devolver menos)
+SUPABASE_PAGE_SIZE = 1000
+# Recursos que não interferem no formulário e são descartados no carregamento das páginas
+BLOCKED_RESOURCE_TYPES = {"image", "font", "media"}
+BLOCKED_HOSTS = (
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net",
+    "facebook.net", "hotjar.com", "clarity.ms",
 )
+# Flags do Chromium que evitam o /dev/shm limitado dos runners e subsistemas sem uso na automação
+CHROMIUM_ARGS = [
+    '--disable-dev-shm-usage',
+    '--no-sandbox',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-features=TranslateUI,BackForwardCache',
+    '--disable-sync',
+    '--disable-default-apps',
+    '--no-first-run',
+    '--mute-audio',
+]
+# Scripts executados no navegador para preencher o formulário com um único round-trip cada
+PREENCHER_CAMPOS_JS = """(dados) => {
+    for (const [id, valor] of Object.entries(dados)) {
+        const campo = document.getElementById(id);
+        campo.value = valor;
+        campo.dispatchEvent(new Event('input', {bubbles: true}));
+        campo.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+}"""
+MARCAR_TITULARES_JS = """(ids) => ids.forEach((id) => document.getElementById(id).click())"""
+# "Adicionar titular" só altera o formulário (não há requisição conhecida): observa a inclusão de elementos nele
+OBSERVAR_TITULAR_JS = """() => {
+    window.__titularAdicionado = false;
+    const form = document.querySelector('button#AdicionarTitular').closest('form') || document.body;
+    const observer = new MutationObserver((mutacoes) => {
+        if (mutacoes.some((m) => m.addedNodes.length)) {
+            window.__titularAdicionado = true;
+            observer.disconnect();
+        }
+    });
+    observer.observe(form, {childList: true, subtree: true});
+}"""
+TITULAR_TIMEOUT_MS = 3000
+# Sessão autenticada do painel salva em disco para pular o login em execuções próximas
+STORAGE_STATE_PATH = 'storage_state.json'
+STORAGE_STATE_MAX_AGE = 60 * 60  # segundos
 
 class WebAutomation:
     def __init__(self):
         self.browser = None
+        self.context = None
         self.page = None
+        self.sessao_em_cache = False
+        # ISRCs aguardando atualização de status em lote
+        self._pending_ok = []
+        self._pending_err = []
+        self.status_queue = None
+        self.status_atualizados = 0
         # Carrega as variáveis de ambiente
         self.login_username = os.getenv('LOGIN_USERNAME')
         self.login_password = os.getenv('LOGIN_PASSWORD')
@@ -42,53 +97,70 @@ class WebAutomation:
         if not all(required_vars):
             raise ValueError("Variáveis de ambiente obrigatórias não foram definidas. Verifique o arquivo .env ou as secrets do GitHub")
 
+        # Sessão HTTP reutilizada em todas as chamadas ao Supabase (keep-alive evita um handshake TLS por registro)
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": self.supabase_api_key,
+            "Authorization": f"Bearer {self.supabase_api_key}",
+            "Content-Type": "application/json"
+        })
+        # PATCH fica fora dos métodos repetidos por padrão no urllib3; aqui é seguro repetir,
+        # pois gravar PAINEL_NEW pelo filtro de ISRC é idempotente
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504], allowed_methods=['GET', 'PATCH'])
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=retries))
+
+        # URLs e corpo das atualizações de status montados uma única vez
+        self._table_url = f"{self.supabase_url}/rest/v1/{self.tabela}"
+        self._patch_url_tpl = f"{self._table_url}?ISRC=eq.{{}}"
+        self._patch_body = {"PAINEL_NEW": "Cadastro OK"}
+
     def buscar_dados_supabase(self):
         """Busca os dados da tabela no Supabase"""
         try:
             logging.info("Buscando dados do Supabase...")
             
-            headers = {
-                "apikey": self.supabase_api_key,
-                "Authorization": f"Bearer {self.supabase_api_key}",
-                "Content-Type": "application/json"
-            }
-            
             # Busca apenas registros que ainda não foram processados (sem status 'Cadastro OK')
-            url = f"{self.supabase_url}/rest/v1/{self.tabela}?select=*&or=(PAINEL_NEW.is.null,PAINEL_NEW.neq.Cadastro OK)"
+            url = f"{self._table_url}?select=ISRC,ARTISTA,TITULARES&or=(PAINEL_NEW.is.null,PAINEL_NEW.neq.Cadastro OK)&order=id.asc"
 
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                dados = response.json()
-                if not dados:
-                    logging.info("Nenhum registro pendente encontrado no Supabase.")
-                    return pd.DataFrame()
-                
-                df = pd.DataFrame(dados)
-                logging.info(f"Encontrados {len(df)} registros para processar no Supabase.")
-                return df
-            else:
-                logging.error(f"Erro ao buscar dados do Supabase: {response.status_code} - {response.text}")
-                return pd.DataFrame()
+            # Pagina pelo header Range, já que o Supabase limita a quantidade de linhas por resposta
+            dados = []
+            inicio = 0
+            while True:
+                headers = {"Range-Unit": "items", "Range": f"{inicio}-{inicio + SUPABASE_PAGE_SIZE - 1}"}
+                response = self.session.get(url, headers=headers)
+
+                # 416 indica que não há registros a partir de `inicio`
+                if response.status_code == 416:
+                    break
+                if response.status_code not in (200, 206):
+                    logging.error(f"Erro ao buscar dados do Supabase: {response.status_code} - {response.text}")
+                    return []
+
+                pagina = orjson.loads(response.content)
+                if not pagina:
+                    break
+                dados.extend(pagina)
+                # Avança pelo que o servidor realmente devolveu: o max-rows do projeto pode ser menor que a página pedida
+                inicio += len(pagina)
+
+            if not dados:
+                logging.info("Nenhum registro pendente encontrado no Supabase.")
+                return []
+
+            logging.info(f"Encontrados {len(dados)} registros para processar no Supabase.")
+            return dados
                 
         except Exception as e:
             logging.error(f"Erro ao conectar com Supabase: {e}")
-            return pd.DataFrame()
+            return []
 
     def atualizar_status_supabase(self, isrc, status='Cadastro OK'):
         """Atualiza o status de um registro no Supabase"""
         try:
-            headers = {
-                "apikey": self.supabase_api_key,
-                "Authorization": f"Bearer {self.supabase_api_key}",
-                "Content-Type": "application/json",
-                "Prefer": "return=minimal"
-            }
+            url = self._patch_url_tpl.format(quote(str(isrc), safe=''))
+            data = self._patch_body if status == 'Cadastro OK' else {"PAINEL_NEW": status}
             
-            url = f"{self.supabase_url}/rest/v1/{self.tabela}?ISRC=eq.{isrc}"
-            data = {"PAINEL_NEW": status}
-            
-            response = requests.patch(url, headers=headers, json=data)
+            response = self.session.patch(url, headers={"Prefer": "return=minimal"}, json=data)
             
             if response.status_code != 204:
                 logging.warning(f"Erro ao atualizar status do ISRC {isrc}: {response.status_code} - {response.text}")
@@ -99,10 +171,113 @@ class WebAutomation:
             logging.error(f"Erro ao atualizar status do ISRC {isrc}: {e}")
             return False
 
+    def atualizar_status_lote(self, isrcs, status):
+        """Atualiza o status de vários registros no Supabase com um único PATCH e retorna quantos foram atualizados"""
+        try:
+            filtro = ','.join(f'"{isrc}"' for isrc in isrcs)
+            data = self._patch_body if status == 'Cadastro OK' else {"PAINEL_NEW": status}
+
+            response = self.session.patch(self._table_url, params={"ISRC": f"in.({filtro})"}, headers={"Prefer": "return=minimal"}, json=data)
+
+            if response.status_code == 204:
+                return len(isrcs)
+
+            logging.warning(f"Erro ao atualizar status de {len(isrcs)} ISRCs em lote: {response.status_code} - {response.text}")
+            if 400 <= response.status_code < 500:
+                # Recorre à atualização individual para isolar o registro problemático
+                return sum(self.atualizar_status_supabase(isrc, status) for isrc in isrcs)
+            return 0
+
+        except Exception as e:
+            logging.error(f"Erro ao atualizar status de {len(isrcs)} ISRCs em lote: {e}")
+            return 0
+
+    async def flush_status(self):
+        """Envia os status pendentes ao Supabase e retorna quantos 'Cadastro OK' foram gravados"""
+        # Os buffers são trocados antes do envio para que as outras páginas continuem acumulando status
+        pendentes_ok, self._pending_ok = self._pending_ok, []
+        pendentes_err, self._pending_err = self._pending_err, []
+
+        # As requisições rodam em uma thread para não bloquear o event loop do Playwright
+        atualizados = 0
+        if pendentes_ok:
+            atualizados = await asyncio.to_thread(self.atualizar_status_lote, pendentes_ok, 'Cadastro OK')
+            if atualizados < len(pendentes_ok):
+                logging.warning(f"{len(pendentes_ok) - atualizados} cadastro(s) realizado(s) mas com erro ao atualizar status")
+        if pendentes_err:
+            await asyncio.to_thread(self.atualizar_status_lote, pendentes_err, 'Erro no Cadastro')
+        return atualizados
+
+    async def _status_consumer(self):
+        """Consome a fila de status e envia ao Supabase em lotes de STATUS_BATCH_SIZE"""
+        while True:
+            isrc, status = await self.status_queue.get()
+            try:
+                if status == 'Cadastro OK':
+                    self._pending_ok.append(isrc)
+                else:
+                    self._pending_err.append(isrc)
+
+                if len(self._pending_ok) + len(self._pending_err) >= STATUS_BATCH_SIZE:
+                    # O await fica fora do += para não perder incrementos enquanto o flush está em andamento
+                    atualizados = await self.flush_status()
+                    self.status_atualizados += atualizados
+            finally:
+                self.status_queue.task_done()
+
     async def start_driver(self):
         playwright = await async_playwright().start()
-        self.browser = await playwright.chromium.launch(headless=True)
-        self.page = await self.browser.new_page()
+        self.browser = await playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS, chromium_sandbox=False)
+        if self.storage_state_valido():
+            logging.info("Reaproveitando sessão do painel salva em cache.")
+            self.context = await self.browser.new_context(storage_state=STORAGE_STATE_PATH)
+            self.sessao_em_cache = True
+        else:
+            self.context = await self.browser.new_context()
+        await self.context.route("**/*", self.bloquear_recursos)
+        self.page = await self.context.new_page()
+
+    def storage_state_valido(self):
+        """Indica se existe uma sessão salva com menos de STORAGE_STATE_MAX_AGE segundos"""
+        try:
+            return time.time() - os.path.getmtime(STORAGE_STATE_PATH) < STORAGE_STATE_MAX_AGE
+        except OSError:
+            return False
+
+    async def validar_sessao_em_cache(self):
+        """Confere se a sessão reaproveitada ainda é aceita pelo painel; se não, descarta o cache"""
+        try:
+            await self.page.goto("https://sistemamd.com.br/musicas/add")
+            if "login" not in self.page.url:
+                return
+            logging.warning("Sessão em cache expirada no painel - será feito novo login.")
+        except Exception as e:
+            logging.warning(f"Erro ao validar sessão em cache, será feito novo login: {e}")
+
+        self.sessao_em_cache = False
+        try:
+            os.remove(STORAGE_STATE_PATH)
+        except OSError:
+            pass
+
+    async def bloquear_recursos(self, route):
+        """Aborta imagens, fontes, mídia e rastreadores que não são necessários para o cadastro"""
+        request = route.request
+        host = urlparse(request.url).hostname or ""
+        if request.resource_type in BLOCKED_RESOURCE_TYPES or host.endswith(BLOCKED_HOSTS):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    async def criar_paginas(self, quantidade):
+        """Abre páginas em contextos novos reaproveitando a sessão autenticada do login"""
+        state = await self.context.storage_state()
+        page_pool = asyncio.Queue()
+        for _ in range(quantidade):
+            context = await self.browser.new_context(storage_state=state)
+            await context.route("**/*", self.bloquear_recursos)
+            page_pool.put_nowait(await context.new_page())
+        return page_pool
 
     async def close_driver(self):
         if self.browser:
@@ -117,82 +292,118 @@ class WebAutomation:
             await self.page.fill('input#login-password', self.login_password)
             await self.page.click('button[type="submit"]')
             
-            # Aguarda um pouco para verificar se o login foi bem-sucedido
-            await self.page.wait_for_timeout(2000)
-            
-            # Verifica se ainda está na página de login (indicaria erro)
-            current_url = self.page.url
-            if "login" in current_url:
+            # Aguarda sair da página de login (permanecer nela indica erro)
+            try:
+                await self.page.wait_for_url(lambda url: "login" not in url, timeout=10_000)
+            except PlaywrightTimeoutError:
                 logging.error("Login falhou - ainda na página de login")
                 return False
                 
             logging.info("Login realizado com sucesso.")
+            await self.context.storage_state(path=STORAGE_STATE_PATH)
             return True
         except Exception as e:
             logging.error(f"Erro ao tentar logar: {e}")
             return False
 
+    async def process_row(self, page, index, row):
+        """Cadastra uma faixa no painel usando a página informada"""
+        # Ajuste os nomes das colunas conforme sua tabela do Supabase
+        isrc = row.get('ISRC')
+        artista = row.get('ARTISTA') 
+        titulares = row.get('TITULARES')
+
+        if not all([isrc, artista, titulares]):
+            logging.warning(f"Dados incompletos na linha {index}: ISRC={isrc}, ARTISTA={artista}, TITULARES={titulares}")
+            return
+
+        try:
+            await page.goto("https://sistemamd.com.br/musicas/add")
+            await page.wait_for_selector('input#titulo')
+            await page.evaluate(PREENCHER_CAMPOS_JS, {"titulo": str(artista), "isrc": str(isrc)})
+            # O select2 depende de eventos reais de teclado, então segue pelo Playwright
+            await page.click('span.select2-selection')
+            titular_input = await page.wait_for_selector('input.select2-search__field')
+            await titular_input.fill(str(titulares))
+            await titular_input.press('Enter')
+            # Os checkboxes de titularidade só ficam disponíveis depois que o select2 resolve o titular
+            await page.wait_for_selector('input#titular_1', state='visible')
+
+            await page.evaluate(MARCAR_TITULARES_JS, [f'titular_{i}' for i in (2, 1, 4, 5, 3)])
+
+            await page.evaluate(OBSERVAR_TITULAR_JS)
+            await page.click('button#AdicionarTitular')
+            try:
+                await page.wait_for_function('window.__titularAdicionado === true', timeout=TITULAR_TIMEOUT_MS)
+            except PlaywrightTimeoutError:
+                # Sem mudança visível no formulário segue para o salvamento, como antes da espera existir
+                logging.debug(f"ISRC: {isrc} - nenhuma alteração no formulário após adicionar titular")
+            # Só considera o cadastro concluído depois que o servidor responde ao envio do formulário,
+            # para a página não voltar ao pool (e navegar) com o salvamento ainda em andamento
+            # Aceita só o envio do formulário (navegação ou POST para /musicas), não beacons ou outras chamadas da página
+            async with page.expect_response(
+                lambda response: response.request.method == 'POST'
+                and (response.request.is_navigation_request() or '/musicas' in urlparse(response.url).path)
+            ) as salvamento:
+                await page.click('button#BtnSalvar')
+            resposta = await salvamento.value
+            # Redirecionamento (3xx) após o POST é o fluxo normal de sucesso
+            if resposta.status >= 400:
+                raise RuntimeError(f"Salvamento retornou HTTP {resposta.status}")
+
+            # Enfileira o status para atualização em lote no Supabase
+            await self.status_queue.put((isrc, 'Cadastro OK'))
+            logging.info(f"ISRC: {isrc}, Artista: {artista}, Titulares: {titulares} - Cadastro realizado")
+                
+        except Exception as e:
+            logging.error(f"Erro durante o cadastro da faixa {index + 1} - ISRC: {isrc}: {e}")
+            # Marca como erro no Supabase
+            await self.status_queue.put((isrc, 'Erro no Cadastro'))
+
     async def run_task_with_time_estimate(self):
         # Busca dados do Supabase ao invés da planilha
-        tabela = self.buscar_dados_supabase()
+        tabela = await asyncio.to_thread(self.buscar_dados_supabase)
         
-        if tabela.empty:
+        if not tabela:
             logging.info("Nenhum dado para processar. Finalizando...")
             return
 
         await self.start_driver()
-        if not await self.login():
+        if self.sessao_em_cache:
+            await self.validar_sessao_em_cache()
+        if not self.sessao_em_cache and not await self.login():
             await self.close_driver()
             return
 
         total_items = len(tabela)
-        contador = 0
-        logging.info(f"Iniciando Cadastro de {total_items} Faixas...")
+        # Não abre páginas que ficariam ociosas quando há menos faixas que CONCURRENCY
+        paginas = min(CONCURRENCY, total_items)
+        logging.info(f"Iniciando Cadastro de {total_items} Faixas com {paginas} páginas em paralelo...")
 
-        for index, row in tqdm(tabela.iterrows(), total=total_items, desc="Progresso"):
-            try:
-                # Ajuste os nomes das colunas conforme sua tabela do Supabase
-                isrc = row.get('ISRC')
-                artista = row.get('ARTISTA') 
-                titulares = row.get('TITULARES')
-
-                if not all([isrc, artista, titulares]):
-                    logging.warning(f"Dados incompletos na linha {index}: ISRC={isrc}, ARTISTA={artista}, TITULARES={titulares}")
-                    continue
-
-                await self.page.goto("https://sistemamd.com.br/musicas/add")
-                await self.page.wait_for_selector('input#titulo')
-                await self.page.fill('input#titulo', str(artista))
-                await self.page.fill('input#isrc', str(isrc))
-                await self.page.click('span.select2-selection')
-                titular_input = await self.page.wait_for_selector('input.select2-search__field')
-                await titular_input.fill(str(titulares))
-                await titular_input.press('Enter')
-                await self.page.wait_for_timeout(500)
-
-                await self.page.click('input#titular_2')
-                await self.page.click('input#titular_1')
-                await self.page.click('input#titular_4')
-                await self.page.click('input#titular_5')
-                await self.page.click('input#titular_3')
-
-                await self.page.wait_for_timeout(500)
-                await self.page.click('button#AdicionarTitular')
-                await self.page.click('button#BtnSalvar')
-
-                # Atualiza o status no Supabase ao invés da planilha
-                if self.atualizar_status_supabase(isrc, 'Cadastro OK'):
-                    logging.info(f"ISRC: {isrc}, Artista: {artista}, Titulares: {titulares} - Status atualizado")
-                    contador += 1
-                else:
-                    logging.warning(f"ISRC: {isrc} - Cadastro realizado mas erro ao atualizar status")
-                    
-            except Exception as e:
-                logging.error(f"Erro durante o cadastro da faixa {index + 1} - ISRC: {isrc}: {e}")
-                # Marca como erro no Supabase
-                self.atualizar_status_supabase(isrc, 'Erro no Cadastro')
-                continue
+        # Cada página é usada por uma faixa de cada vez; a fila limita a concorrência
+        page_pool = await self.criar_paginas(paginas)
+
+        self.status_queue = asyncio.Queue(maxsize=STATUS_QUEUE_SIZE)
+        # Um único consumidor basta: ele só acumula os status e envia os lotes
+        consumer = asyncio.create_task(self._status_consumer())
+
+        with tqdm(total=total_items, desc="Progresso") as pbar:
+            async def processar(index, row):
+                page = await page_pool.get()
+                try:
+                    await self.process_row(page, index, row)
+                finally:
+                    page_pool.put_nowait(page)
+                    pbar.update(1)
+
+            await asyncio.gather(*(processar(index, row) for index, row in enumerate(tabela)))
 
+        # Aguarda a fila esvaziar, encerra os consumidores e envia o último lote parcial
+        await self.status_queue.join()
+        consumer.cancel()
+        await asyncio.gather(consumer, return_exceptions=True)
+        atualizados = await self.flush_status()
+        contador = self.status_atualizados + atualizados
         logging.info(f"Total de {contador} faixas cadastradas com sucesso.")
         await self.send_telegram_notification(contador)
         await self.close_driver()
@@ -219,4 +430,12 @@ async def main():
         logging.error(f"Erro inesperado: {e}")
 
 if __name__ == "__main__":
+    # Configuração do logging (apenas ao executar o script, para não truncar o log ao importar o módulo)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s: %(message)s",
+        datefmt='%d/%m/%Y %H:%M:%S',
+        filename='painel_novo.log',
+        filemode='w',
+    )
     asyncio.run(main())
@@ -83,4 +83,41 @@ USING (true);
 INSERT INTO public.cadastros ("ISRC", "ARTISTA", "TITULARES") VALUES
     ('BRZ123400001', 'Artista A', 'Titular A'),
     ('BRZ123400002', 'Artista B', 'Titular B'),
-    ('BRZ123400003', 'Artista C', 'Titular C');
\ No newline at end of file
+    ('BRZ123400003', 'Artista C', 'Titular C');
+
+-- As funções abaixo podem ser instaladas em um banco existente executando apenas estes blocos
+-- (não rode o arquivo inteiro: o DROP TABLE do início apaga todos os dados)
+
+-- Função para limpar a tabela de uma vez (usada pelo upload_planilha_supabase.py)
+CREATE OR REPLACE FUNCTION public.truncate_cadastros()
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    TRUNCATE TABLE public.cadastros RESTART IDENTITY;
+$$;
+
+-- Função para gravar a planilha inteira em uma única transação (usada com --atomico)
+-- Só grava as colunas "ISRC", "ARTISTA", "TITULARES" e "PAINEL_NEW"; outras chaves do payload são ignoradas.
+-- "PAINEL_NEW" só é sobrescrito se vier no payload, para não apagar o status gravado pela automação.
+CREATE OR REPLACE FUNCTION public.bulk_upsert_cadastros(payload jsonb)
+RETURNS void
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+DECLARE
+    tem_status boolean := EXISTS (
+        SELECT 1 FROM jsonb_array_elements(payload) AS registro WHERE registro ? 'PAINEL_NEW'
+    );
+BEGIN
+    INSERT INTO public.cadastros ("ISRC", "ARTISTA", "TITULARES", "PAINEL_NEW")
+    SELECT "ISRC", "ARTISTA", "TITULARES", "PAINEL_NEW"
+    FROM jsonb_populate_recordset(NULL::public.cadastros, payload)
+    ON CONFLICT ("ISRC") DO UPDATE
+    SET "ARTISTA" = EXCLUDED."ARTISTA",
+        "TITULARES" = EXCLUDED."TITULARES",
+        "PAINEL_NEW" = CASE WHEN tem_status THEN EXCLUDED."PAINEL_NEW" ELSE cadastros."PAINEL_NEW" END;
+END;
+$$;
\ No newline at end of file
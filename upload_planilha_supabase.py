@@ -1,43 +1,88 @@
+import argparse
 import pandas as pd
+import gzip
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import logging
 import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Optional
 from tqdm import tqdm
 from dotenv import load_dotenv
 
-# Carrega as variáveis de ambiente do arquivo .env
-load_dotenv()
-
-# Carrega configurações das variáveis de ambiente
-SUPABASE_URL = os.getenv('SUPABASE_URL')
-SUPABASE_API_KEY = os.getenv('SUPABASE_API_KEY')
-TABELA = os.getenv('TABELA', 'cadastros')  # valor padrão
-PLANILHA = os.getenv('PLANILHA', 'Emitir.xlsx')  # valor padrão
-
-# Validação das variáveis obrigatórias
-if not all([SUPABASE_URL, SUPABASE_API_KEY]):
-    raise ValueError("Variáveis de ambiente SUPABASE_URL e SUPABASE_API_KEY são obrigatórias. Verifique o arquivo .env")
-
-# Configurar logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s"
-)
-
-headers = {
-    "apikey": SUPABASE_API_KEY,
-    "Authorization": f"Bearer {SUPABASE_API_KEY}",
-    "Content-Type": "application/json",
-    "Prefer": "return=minimal"
-}
-
-def verificar_estrutura_tabela():
+# Quantidade de registros enviados por requisição no insert em lote
+BATCH_SIZE = 500
+# Respostas em que dividir o lote ajuda a isolar o registro com problema
+STATUS_BISSECAO = {400, 409, 413, 422}
+# Arquivo com as linhas da planilha descartadas na validação local
+REJEITADOS_CSV = 'rejeitados.csv'
+# Corpos menores que isso vão sem compressão (o custo do gzip não compensa)
+GZIP_MIN_BYTES = 2048
+
+@dataclass
+class Config:
+    """Configurações do upload, carregadas das variáveis de ambiente por _load_config()"""
+    supabase_url: str
+    supabase_api_key: str
+    tabela: str = 'cadastros'
+    planilha: str = 'Emitir.xlsx'
+    supabase_db_url: Optional[str] = None  # conexão Postgres, usada apenas no modo --direct
+    upload_workers: int = 8  # lotes enviados em paralelo (limitado para não esbarrar no rate limit do Supabase)
+    comprimir_gzip: bool = False  # envia os corpos com Content-Encoding: gzip (exige suporte no gateway)
+    session: requests.Session = field(init=False, repr=False)
+
+    def __post_init__(self):
+        # Sessão HTTP única com pool de conexões, reaproveitada por todas as chamadas ao Supabase
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": self.supabase_api_key,
+            "Authorization": f"Bearer {self.supabase_api_key}",
+            "Content-Type": "application/json",
+            "Prefer": "return=minimal"
+        })
+        # Falhas transitórias (rate limit e gateway) são repetidas com backoff exponencial, respeitando o Retry-After
+        retries = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=['GET', 'HEAD', 'POST', 'DELETE'],
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=max(64, self.upload_workers), max_retries=retries))
+
+def _load_config():
+    """Carrega e valida as configurações do arquivo .env / variáveis de ambiente"""
+    # Carrega as variáveis de ambiente do arquivo .env
+    load_dotenv()
+
+    supabase_url = os.getenv('SUPABASE_URL')
+    supabase_api_key = os.getenv('SUPABASE_API_KEY')
+
+    # Validação das variáveis obrigatórias
+    if not all([supabase_url, supabase_api_key]):
+        raise ValueError("Variáveis de ambiente SUPABASE_URL e SUPABASE_API_KEY são obrigatórias. Verifique o arquivo .env")
+
+    return Config(
+        supabase_url=supabase_url,
+        supabase_api_key=supabase_api_key,
+        tabela=os.getenv('TABELA', 'cadastros'),  # valor padrão
+        planilha=os.getenv('PLANILHA', 'Emitir.xlsx'),  # valor padrão
+        supabase_db_url=os.getenv('SUPABASE_DB_URL'),
+        upload_workers=int(os.getenv('UPLOAD_WORKERS', 8)),
+        comprimir_gzip=os.getenv('UPLOAD_GZIP', '').lower() in ('1', 'true', 'sim'),
+    )
+
+def verificar_estrutura_tabela(config):
     """Verifica a estrutura da tabela no Supabase"""
     try:
         # Tenta fazer uma consulta simples para ver a estrutura
-        url = f"{SUPABASE_URL}/rest/v1/{TABELA}?limit=1"
-        response = requests.get(url, headers=headers)
+        url = f"{config.supabase_url}/rest/v1/{config.tabela}?limit=1"
+        response = config.session.get(url)
         if response.status_code == 200:
             logging.info("Conexão com Supabase estabelecida com sucesso.")
             return True
@@ -48,95 +93,324 @@ def verificar_estrutura_tabela():
         logging.exception(f"Erro ao verificar estrutura da tabela: {e}")
         return False
 
-def limpar_tabela():
+def aquecer_conexoes(config):
+    """Abre em paralelo uma conexão por thread de upload, tirando DNS e handshake TLS do caminho dos lotes"""
+    url = f"{config.supabase_url}/rest/v1/{config.tabela}?limit=0"
+
+    def head(_):
+        try:
+            config.session.head(url)
+        except Exception as e:
+            logging.debug(f"Falha ao aquecer conexão: {e}")
+
+    with ThreadPoolExecutor(max_workers=config.upload_workers) as executor:
+        list(executor.map(head, range(config.upload_workers)))
+
+def limpar_tabela(config):
     """Limpa todos os registros da tabela no Supabase"""
     try:
-        # Usa ISRC (que existe em todos os registros) ao invés de id
-        url = f"{SUPABASE_URL}/rest/v1/{TABELA}?ISRC=neq."
-        response = requests.delete(url, headers=headers)
+        # TRUNCATE via RPC (função truncate_<tabela> em supabase_cadastros.sql) ao invés de DELETE linha a linha
+        url = f"{config.supabase_url}/rest/v1/rpc/truncate_{config.tabela}"
+        response = config.session.post(url)
+        if response.status_code == 404:
+            # Função não instalada no banco: volta ao DELETE, que funciona com qualquer tabela
+            logging.warning(f"Função truncate_{config.tabela} não encontrada; limpando a tabela via DELETE")
+            response = config.session.delete(f"{config.supabase_url}/rest/v1/{config.tabela}", params={"ISRC": "neq."})
         
-        if response.status_code != 204:
+        if response.status_code not in (200, 204):
             logging.error(f"Erro ao limpar tabela: {response.status_code} - {response.text}")
         else:
             logging.info("Tabela limpa com sucesso.")
     except Exception as e:
         logging.exception(f"Erro ao tentar limpar a tabela: {e}")
 
-def upload_planilha():
+def _serializar(valor):
+    """Converte para JSON os tipos que o orjson não conhece (ex.: pd.Timestamp)"""
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(valor).__name__}")
+
+def codificar_corpo(config, dados):
+    """Serializa o corpo da requisição e retorna (body, headers extras)"""
+    # O corpo é codificado com orjson (bem mais rápido que o json da stdlib usado pelo requests)
+    body = orjson.dumps(dados, default=_serializar, option=orjson.OPT_SERIALIZE_NUMPY)
+    # Dados de planilha comprimem bem, mas o PostgREST não descomprime: só vale atrás de um gateway que aceite gzip
+    if config.comprimir_gzip and len(body) >= GZIP_MIN_BYTES:
+        return gzip.compress(body, compresslevel=3), {"Content-Encoding": "gzip"}
+    return body, {}
+
+def enviar_lote(config, lote, colunas):
+    """Insere ou atualiza (upsert por ISRC) um lote de registros no Supabase e retorna (sucessos, erros).
+
+    Os registros podem omitir colunas vazias: `columns` informa ao PostgREST o conjunto
+    completo e `missing=default` aplica o valor padrão da tabela às chaves ausentes.
+    Em erros causados por registros (STATUS_BISSECAO) o lote é dividido ao meio até isolar o inválido.
+    """
+    body, lote_headers = codificar_corpo(config, lote)
+    # Upsert por ISRC: registros já existentes são atualizados e a importação pode ser repetida
+    lote_headers["Prefer"] = "resolution=merge-duplicates,return=minimal,missing=default"
+    response = config.session.post(
+        f"{config.supabase_url}/rest/v1/{config.tabela}",
+        params={"columns": ",".join(colunas), "on_conflict": "ISRC"},
+        headers=lote_headers,
+        data=body,
+    )
+
+    if response.status_code == 201:
+        return len(lote), 0
+
+    # Só divide o lote em erros causados pelo conteúdo (registro inválido, conflito, corpo grande demais);
+    # 401/403/404/429 etc. afetam o lote inteiro e dividir só geraria mais requisições
+    if len(lote) > 1 and response.status_code in STATUS_BISSECAO:
+        meio = len(lote) // 2
+        sucessos_a, erros_a = enviar_lote(config, lote[:meio], colunas)
+        sucessos_b, erros_b = enviar_lote(config, lote[meio:], colunas)
+        return sucessos_a + sucessos_b, erros_a + erros_b
+
+    if len(lote) == 1:
+        logging.warning(f"Erro ao subir registro - ISRC {lote[0].get('ISRC', 'N/A')}: {response.text}")
+    else:
+        logging.warning(f"Erro ao subir lote de {len(lote)} registros: {response.status_code} - {response.text}")
+    return 0, len(lote)
+
+def gerar_lotes(df):
+    """Gera os lotes de registros sob demanda, sem materializar a planilha inteira como dicts"""
+    colunas = list(df.columns)
+    for inicio in range(0, len(df), BATCH_SIZE):
+        parte = df.iloc[inicio:inicio + BATCH_SIZE]
+        # Extrai cada coluna como lista (NaN/NA viram None) e monta os registros com zip,
+        # sem passar pela materialização genérica de linhas do to_dict
+        valores = [parte[c].astype(object).where(parte[c].notna(), None).tolist() for c in colunas]
+        # Omite as células vazias, como o dropna por linha fazia antes
+        yield [{k: v for k, v in zip(colunas, linha) if v is not None} for linha in zip(*valores)]
+
+def ler_planilha(config):
+    """Lê a planilha Excel e normaliza colunas e textos"""
+    # Reaproveita a cópia em Parquet enquanto a planilha não for modificada
+    cache = config.planilha + '.parquet'
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(config.planilha):
+        logging.info(f"Lendo planilha do cache {cache}")
+        df = pd.read_parquet(cache)
+    else:
+        # Lê a planilha Excel (calamine é bem mais rápido e econômico que o openpyxl padrão)
+        df = pd.read_excel(config.planilha, engine='calamine')
+        try:
+            df.to_parquet(cache, compression='zstd')
+        except Exception as e:
+            # Colunas com tipos misturados não são aceitas pelo Parquet; segue sem cache
+            logging.warning(f"Não foi possível gravar o cache {cache}: {e}")
+    
+    # Mostra a estrutura original da planilha
+    logging.info(f"Colunas encontradas na planilha: {list(df.columns)}")
+    
+    # Normaliza os nomes de colunas para MAIÚSCULAS
+    df.columns = [col.upper().strip() for col in df.columns]
+    logging.info(f"Colunas após normalização: {list(df.columns)}")
+    
+    # Remove espaços extras das colunas de texto: colunas só de texto usam o .str vetorizado;
+    # colunas mistas tratam célula a célula e as demais (bool, time etc.) não são tocadas
+    for coluna in df.select_dtypes(include=['object', 'string']).columns:
+        tipo = pd.api.types.infer_dtype(df[coluna], skipna=True)
+        if tipo == 'string':
+            df[coluna] = df[coluna].str.strip()
+        elif tipo.startswith('mixed'):
+            df[coluna] = df[coluna].map(lambda v: v.strip() if isinstance(v, str) else v)
+    
+    if 'ISRC' in df.columns:
+        # Descarta localmente linhas sem ISRC válido, que só seriam rejeitadas pelo Supabase
+        tamanho_isrc = df['ISRC'].astype('string').str.len()
+        validos = tamanho_isrc.between(8, 16).fillna(False).astype(bool)
+        rejeitados = df.loc[~validos]
+        if not rejeitados.empty:
+            rejeitados.to_csv(REJEITADOS_CSV, index=False)
+            logging.warning(f"{len(rejeitados)} linhas rejeitadas localmente por ISRC inválido (salvas em {REJEITADOS_CSV})")
+        df = df.loc[validos]
+        
+        # ISRC é único na tabela: duplicatas só gerariam erros de constraint (mantém a última ocorrência)
+        antes = len(df)
+        df = df.drop_duplicates(subset=['ISRC'], keep='last')
+        logging.info(f"Removidas {antes - len(df)} linhas duplicadas por ISRC")
+    return df
+
+def upload_planilha(config):
     """Faz upload dos dados da planilha para o Supabase"""
     try:
-        # Lê a planilha Excel
-        df = pd.read_excel(PLANILHA)
-        
-        # Mostra a estrutura original da planilha
-        logging.info(f"Colunas encontradas na planilha: {list(df.columns)}")
+        df = ler_planilha(config)
+        colunas = list(df.columns)
         
-        # Normaliza os nomes de colunas para MAIÚSCULAS
-        df.columns = [col.upper().strip() for col in df.columns]
-        logging.info(f"Colunas após normalização: {list(df.columns)}")
-        
-        logging.info(f"Importando {len(df)} registros para Supabase...")
+        logging.info(f"Importando {len(df)} registros para Supabase em lotes de {BATCH_SIZE}...")
         
         # Contador de sucessos e erros
         sucessos = 0
         erros = 0
         
         # Barra de progresso com TQDM
-        with tqdm(total=len(df), desc="Importando", unit="registro") as pbar:
-            # Itera sobre cada linha da planilha
-            for index, row in df.iterrows():
-                dados = row.dropna().to_dict()
-                
-                # Remove espaços extras dos valores string
-                dados_limpos = {}
-                for key, value in dados.items():
-                    if isinstance(value, str):
-                        dados_limpos[key] = value.strip()
-                    else:
-                        dados_limpos[key] = value
-                
-                # Faz a requisição POST para inserir os dados
-                response = requests.post(f"{SUPABASE_URL}/rest/v1/{TABELA}", headers=headers, json=dados_limpos)
-                
-                if response.status_code != 201:
-                    erros += 1
-                    # Atualiza a descrição da barra com erro
-                    pbar.set_postfix({"✅": sucessos, "❌": erros, "Último": f"ERRO - {dados_limpos.get('ISRC', 'N/A')}"})
-                    logging.warning(f"Erro ao subir registro {index + 1} - ISRC {dados_limpos.get('ISRC', 'N/A')}: {response.text}")
-                else:
-                    sucessos += 1
-                    # Atualiza a descrição da barra com sucesso
-                    pbar.set_postfix({"✅": sucessos, "❌": erros, "Último": dados_limpos.get('ISRC', 'N/A')})
-                
-                # Atualiza a barra de progresso
-                pbar.update(1)
+        # A barra é redesenhada no máximo a cada 0,5 s; o postfix só a cada 10 lotes
+        with tqdm(total=len(df), desc="Importando", unit="registro", mininterval=0.5) as pbar, \
+                ThreadPoolExecutor(max_workers=config.upload_workers) as executor:
+            pendentes = {}
+            lotes_concluidos = 0
+
+            def coletar(concluidos):
+                nonlocal sucessos, erros, lotes_concluidos
+                for future in concluidos:
+                    tamanho = pendentes.pop(future)
+                    try:
+                        sucessos_lote, erros_lote = future.result()
+                    except Exception as e:
+                        logging.error(f"Erro ao enviar lote de {tamanho} registros: {e}")
+                        sucessos_lote, erros_lote = 0, tamanho
+                    sucessos += sucessos_lote
+                    erros += erros_lote
+                    lotes_concluidos += 1
+                    
+                    if lotes_concluidos % 10 == 0:
+                        pbar.set_postfix({"✅": sucessos, "❌": erros}, refresh=False)
+                    pbar.update(tamanho)
+
+            # A conversão dos próximos lotes acontece enquanto os anteriores estão na rede;
+            # no máximo 2 lotes por thread ficam em memória aguardando envio
+            for lote in gerar_lotes(df):
+                if len(pendentes) >= config.upload_workers * 2:
+                    concluidos, _ = wait(pendentes, return_when=FIRST_COMPLETED)
+                    coletar(concluidos)
+                pendentes[executor.submit(enviar_lote, config, lote, colunas)] = len(lote)
+            coletar(as_completed(list(pendentes)))
+            pbar.set_postfix({"✅": sucessos, "❌": erros})
         
         logging.info(f"Importação finalizada: {sucessos} sucessos, {erros} erros")
                 
     except FileNotFoundError:
-        logging.error(f"Arquivo {PLANILHA} não encontrado.")
+        logging.error(f"Arquivo {config.planilha} não encontrado.")
+    except Exception as e:
+        logging.exception(f"Erro ao fazer upload da planilha: {e}")
+
+def upload_planilha_atomico(config):
+    """Envia a planilha inteira em uma única chamada RPC, gravada pelo banco em uma só transação.
+
+    A função bulk_upsert_<tabela> grava apenas ISRC, ARTISTA, TITULARES e PAINEL_NEW;
+    outras colunas da planilha são ignoradas nesse modo.
+    """
+    try:
+        df = ler_planilha(config)
+        records = [registro for lote in gerar_lotes(df) for registro in lote]
+        
+        logging.info(f"Importando {len(records)} registros para Supabase em uma única transação...")
+        
+        # Função bulk_upsert_<tabela> definida em supabase_cadastros.sql
+        body, rpc_headers = codificar_corpo(config, {"payload": records})
+        response = config.session.post(f"{config.supabase_url}/rest/v1/rpc/bulk_upsert_{config.tabela}", headers=rpc_headers, data=body)
+        
+        if response.status_code in (200, 204):
+            logging.info(f"Importação finalizada: {len(records)} registros gravados")
+        else:
+            logging.error(f"Erro na importação em transação única, nenhum registro gravado: {response.status_code} - {response.text}")
+                
+    except FileNotFoundError:
+        logging.error(f"Arquivo {config.planilha} não encontrado.")
     except Exception as e:
         logging.exception(f"Erro ao fazer upload da planilha: {e}")
 
+def upload_planilha_copy(config):
+    """Carrega a planilha direto no Postgres do Supabase via COPY, em uma única transação.
+
+    O COPY vai para uma tabela temporária e de lá é feito upsert por ISRC na tabela de destino,
+    então, assim como no modo padrão, a importação pode ser repetida sem --reset.
+    """
+    try:
+        import psycopg
+        from psycopg import sql
+    except ImportError:
+        logging.error('O modo --direct requer o pacote psycopg. Instale com: pip install "psycopg[binary]"')
+        return
+
+    if not config.supabase_db_url:
+        logging.error("A variável SUPABASE_DB_URL é obrigatória no modo --direct. Verifique o arquivo .env")
+        return
+
+    try:
+        df = ler_planilha(config)
+        colunas = list(df.columns)
+        
+        logging.info(f"Importando {len(df)} registros para Supabase via COPY...")
+        
+        tabela = sql.Identifier(config.tabela)
+        temporaria = sql.Identifier(f"{config.tabela}_import")
+        lista_colunas = sql.SQL(", ").join(map(sql.Identifier, colunas))
+        # Tabela temporária só com as colunas da planilha (sem constraints), descartada no commit
+        criar_temporaria = sql.SQL("CREATE TEMP TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA").format(
+            temporaria, lista_colunas, tabela,
+        )
+        comando = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV)").format(temporaria, lista_colunas)
+        # COPY não tem ON CONFLICT: o upsert por ISRC é feito a partir da tabela temporária
+        atualizacoes = [
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(coluna))
+            for coluna in colunas if coluna != 'ISRC'
+        ]
+        conflito = (sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(atualizacoes))
+                    if atualizacoes else sql.SQL("DO NOTHING"))
+        upsert = sql.SQL('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT ("ISRC") {3}').format(
+            tabela, lista_colunas, temporaria, conflito,
+        )
+        # A conexão faz commit ao sair do bloco: ou todos os registros entram, ou nenhum
+        with psycopg.connect(config.supabase_db_url) as conn, conn.cursor() as cur:
+            cur.execute(criar_temporaria)
+            with cur.copy(comando) as copy, tqdm(total=len(df), desc="Importando", unit="registro", mininterval=0.5) as pbar:
+                for inicio in range(0, len(df), BATCH_SIZE):
+                    parte = df.iloc[inicio:inicio + BATCH_SIZE]
+                    copy.write(parte.to_csv(index=False, header=False))
+                    pbar.update(len(parte))
+            cur.execute(upsert)
+        
+        logging.info(f"Importação via COPY finalizada: {len(df)} registros")
+                
+    except FileNotFoundError:
+        logging.error(f"Arquivo {config.planilha} não encontrado.")
+    except Exception as e:
+        logging.exception(f"Erro ao importar a planilha via COPY: {e}")
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa a planilha Excel para a tabela do Supabase")
+    # Os modos de envio são alternativos entre si
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument('--direct', action='store_true',
+                      help="carrega via COPY direto no Postgres (requer psycopg e SUPABASE_DB_URL)")
+    modo.add_argument('--atomico', action='store_true',
+                      help="envia tudo em uma única transação via RPC bulk_upsert_<tabela>")
+    parser.add_argument('--reset', action='store_true',
+                        help="limpa a tabela antes de importar (por padrão é feito upsert por ISRC)")
+    args = parser.parse_args()
+
+    # Configurar logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s"
+    )
+
     try:
+        config = _load_config()
         logging.info("Iniciando processo de importação...")
         
         # Verifica se consegue conectar com o Supabase
-        if not verificar_estrutura_tabela():
+        if not verificar_estrutura_tabela(config):
             logging.error("Não foi possível conectar com o Supabase. Verifique as configurações.")
             exit(1)
         
-        # Pergunta se deve limpar a tabela
-        print(f"\nPlanilha encontrada: {PLANILHA}")
-        print(f"Tabela de destino: {TABELA}")
-        print(f"URL do Supabase: {SUPABASE_URL}")
-        resposta = input("\nDeseja limpar a tabela antes de importar? (s/n): ").lower().strip()
-        if resposta in ['s', 'sim', 'y', 'yes']:
+        print(f"\nPlanilha encontrada: {config.planilha}")
+        print(f"Tabela de destino: {config.tabela}")
+        print(f"URL do Supabase: {config.supabase_url}")
+        # A limpeza só é feita quando pedida explicitamente; o padrão é atualizar via upsert
+        if args.reset:
             print("Limpando tabela...")
-            limpar_tabela()
+            limpar_tabela(config)
         
-        upload_planilha()
+        if args.direct:
+            upload_planilha_copy(config)
+        elif args.atomico:
+            upload_planilha_atomico(config)
+        else:
+            aquecer_conexoes(config)
+            upload_planilha(config)
         logging.info("Processo de importação finalizado.")
         
     except ValueError as e: